@@ -1,13 +1,21 @@
 
 
 import os
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, request, jsonify, g
 from tensorflow.keras.models import load_model
 from PIL import Image
 import numpy as np
 from flask_cors import CORS
 import cv2
 import logging
+from serialization import choose_format, encode_response
+from scheduler import InferenceScheduler, SchedulerError, request_deadline, request_priority
+from gate import GateRejected, check_image
+from tiling import ImageTooLarge, check_tiling_size, load_tiling_image, predict_tiles
+from similarity import VectorIndex, build_embedding_model
+from tta import refine_with_tta
+from monitor import PredictionMonitor, parse_window
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -19,7 +27,7 @@ CORS(app, resources={
     r"/*": {
         "origins": ["http://localhost:5173", "http://127.0.0.1:5173", "http://localhost:3000", "http://127.0.0.1:3000"],
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
+        "allow_headers": ["Content-Type", "Accept", "X-Priority", "X-Deadline-Ms", "X-API-Key"]
     }
 })
 
@@ -50,6 +58,28 @@ bone_fracture_model.compile(optimizer='adam', loss='binary_crossentropy', metric
 anemia_model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
 skin_cancer_model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
 
+models = {
+    'brain_tumor': brain_tumor_model,
+    'breast_cancer': breast_cancer_model,
+    'pneumonia': pneumonia_model,
+    'bone_fracture': bone_fracture_model,
+    'anemia': anemia_model,
+    'skin_cancer': skin_cancer_model,
+}
+
+# Same forward pass also returns the penultimate-layer embedding, which
+# feeds the per-model similar-case index (see similarity.py)
+embedding_models = {name: build_embedding_model(model) for name, model in models.items()}
+SIMILARITY_INDEX_DIR = os.environ.get('ML_SIMILARITY_INDEX_DIR', 'similarity_index')
+similarity_indexes = {name: VectorIndex(os.path.join(SIMILARITY_INDEX_DIR, name)) for name in models}
+MAX_SIMILAR_CASES = 100
+
+# Admission control in front of model execution (see scheduler.py)
+scheduler = InferenceScheduler()
+
+# Streaming confidence/class/intensity statistics, aggregated off the request path
+monitor = PredictionMonitor()
+
 # Class names for pneumonia
 pneumonia_names = {
     0: 'Normal',
@@ -216,6 +246,93 @@ def preprocess_anemia_image(image_stream, img_size=(224, 224)):
         raise
 
 
+@app.before_request
+def record_request_start():
+    # Deadlines are measured from arrival, so time spent queued counts
+    g.request_started = time.monotonic()
+
+@app.before_request
+def resolve_response_format():
+    # Refuse an unsupported ?format= before any gate, scheduler or model work
+    if request.method == 'POST' and request.path.startswith('/predict/'):
+        g.response_format = choose_format(request)
+        if g.response_format[0] is None:
+            return jsonify({'error': f"Unsupported response format: {request.args.get('format')}"}), 406
+
+def run_gate(model_key, image_stream):
+    """Reject uploads of the wrong modality before any model work; ?gate=off skips the check."""
+    if request.args.get('gate', '').lower() in ('0', 'off', 'false'):
+        return
+    check_image(model_key, image_stream)
+
+def inference_slot():
+    """Scheduler slot for the current request's priority and deadline."""
+    priority = request_priority(request)
+    deadline = request_deadline(request, priority, g.request_started)
+    return scheduler.slot(priority, deadline)
+
+def tta_requested():
+    return request.args.get('tta', '').lower() in ('1', 'true', 'yes')
+
+def run_model(model_key, img_array):
+    """
+    Run the model once the scheduler admits this request.
+    Returns the predictions; the embedding from the same pass is kept on g.
+    With ?tta=1, borderline predictions are averaged over one extra batch of
+    augmented views in the same slot (see tta.py).
+    """
+    with inference_slot():
+        embeddings, predictions = embedding_models[model_key].predict(img_array)
+        if tta_requested():
+            predictions, g.tta = refine_with_tta(
+                lambda batch: models[model_key].predict(batch, verbose=0), img_array, predictions
+            )
+    g.embedding = (model_key, embeddings[0])
+    g.model_key, g.model_input = model_key, img_array
+    return predictions
+
+def index_case(result):
+    """Add this request's embedding to the similar-case index when a case_id was sent."""
+    case_id = request.form.get('case_id')
+    if not case_id or 'embedding' not in g:
+        return
+    model_key, embedding = g.embedding
+    similarity_indexes[model_key].add(embedding, {
+        'case_id': case_id,
+        'prediction': result.get('prediction'),
+        'confidence': result.get('confidence'),
+    })
+
+def tiled_mode_requested():
+    return request.args.get('mode') == 'tiled'
+
+def run_tiled_model(model_key, image_stream):
+    """
+    Tiled sliding-window inference (see tiling.py). Decoding happens before
+    admission; all tile batches then run under a single scheduler slot.
+    """
+    image, scale = load_tiling_image(image_stream)
+    with inference_slot():
+        tiled = predict_tiles(image, lambda batch: models[model_key].predict(batch, verbose=0), scale)
+    g.model_key, g.model_input = model_key, image
+    return tiled
+
+def prediction_response(result, predictions):
+    """
+    Encode a prediction result in the format the client asked for.
+    The raw model output is only serialized when requested (see serialization.py).
+    """
+    # Resolved (and validated) in resolve_response_format before the model ran
+    mimetype, include_raw = g.response_format
+    index_case(result)
+    if 'model_key' in g:
+        monitor.record(g.model_key, result['prediction'], result['confidence'], g.get('model_input'))
+    if 'tta' in g:
+        result = dict(result, tta=g.tta)
+    body = encode_response(result, predictions, mimetype, include_raw)
+    return app.response_class(body, mimetype=mimetype)
+
+
 # Brain tumor prediction endpoint
 @app.route('/predict/brain_tumor', methods=['POST'])
 def predict_brain_tumor():
@@ -223,19 +340,23 @@ def predict_brain_tumor():
         return jsonify({'error': 'No image uploaded'}), 400
     image = request.files['image']
     try:
+        run_gate('brain_tumor', image.stream)
         img_array = preprocess_brain_tumor_image(image.stream)
-        predictions = brain_tumor_model.predict(img_array)
+        predictions = run_model('brain_tumor', img_array)
         predicted_class_index = int(np.argmax(predictions, axis=1)[0])
         predicted_class_name = tumor_names.get(predicted_class_index, "Unknown")
         is_tumor_present = predicted_class_name != 'No Tumor'
         confidence = float(np.max(predictions))
 
-        return jsonify({
+        return prediction_response({
             'prediction': predicted_class_name,
             'is_disease_present': is_tumor_present,
-            'confidence': confidence,
-            'raw': predictions.tolist()
-        })
+            'confidence': confidence
+        }, predictions)
+    except GateRejected as e:
+        return jsonify({'error': str(e), 'gate': e.stats}), e.status_code
+    except SchedulerError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -246,18 +367,36 @@ def predict_breast_cancer():
         return jsonify({'error': 'No image uploaded'}), 400
     image = request.files['image']
     try:
-        img_array = preprocess_breast_cancer_image(image.stream)
-        predictions = breast_cancer_model.predict(img_array)
+        if tiled_mode_requested():
+            # Refuse oversized tiled uploads from the header, before the gate decodes anything
+            check_tiling_size(image.stream)
+        run_gate('breast_cancer', image.stream)
+        tiled = None
+        if tiled_mode_requested():
+            tiled = run_tiled_model('breast_cancer', image.stream)
+            predictions = np.array([[tiled['score']]], dtype='float32')
+        else:
+            img_array = preprocess_breast_cancer_image(image.stream)
+            predictions = run_model('breast_cancer', img_array)
         prediction_value = float(predictions[0][0])
         predicted_class_index = 1 if prediction_value >= 0.5 else 0
         predicted_class_name = breast_cancer_names.get(predicted_class_index, "Unknown")
 
-        return jsonify({
+        result = {
             'prediction': predicted_class_name,
             'is_disease_present': predicted_class_index == 1,
-            'confidence': prediction_value if predicted_class_index == 1 else 1 - prediction_value,
-            'raw': predictions.tolist()
-        })
+            'confidence': prediction_value if predicted_class_index == 1 else 1 - prediction_value
+        }
+        if tiled:
+            # Image-level score, coarse per-tile heatmap and tile counts
+            result['tiled'] = tiled
+        return prediction_response(result, predictions)
+    except GateRejected as e:
+        return jsonify({'error': str(e), 'gate': e.stats}), e.status_code
+    except ImageTooLarge as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except SchedulerError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error in breast cancer prediction: {str(e)}")  # For debugging
         return jsonify({'error': str(e)}), 500
@@ -269,23 +408,27 @@ def predict_pneumonia():
         return jsonify({'error': 'No image uploaded'}), 400
     image = request.files['image']
     try:
+        run_gate('pneumonia', image.stream)
         img_array = preprocess_pneumonia_image(image.stream)
         # Match model's expected channels if needed
         expected_channels = pneumonia_model.input_shape[-1]
         if expected_channels != img_array.shape[-1]:
             img_array = np.repeat(img_array, expected_channels, axis=-1)
         
-        predictions = pneumonia_model.predict(img_array)
+        predictions = run_model('pneumonia', img_array)
         prediction_value = float(predictions[0][0])
         predicted_class_index = 1 if prediction_value >= 0.5 else 0
         predicted_class_name = pneumonia_names.get(predicted_class_index, "Unknown")
         
-        return jsonify({
+        return prediction_response({
             'prediction': predicted_class_name,
             'is_disease_present': predicted_class_index == 1,
-            'confidence': prediction_value if predicted_class_index == 1 else 1 - prediction_value,
-            'raw': predictions.tolist()
-        })
+            'confidence': prediction_value if predicted_class_index == 1 else 1 - prediction_value
+        }, predictions)
+    except GateRejected as e:
+        return jsonify({'error': str(e), 'gate': e.stats}), e.status_code
+    except SchedulerError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error in pneumonia prediction: {str(e)}")  # For debugging
         return jsonify({'error': str(e)}), 500
@@ -297,23 +440,27 @@ def predict_bone_fracture():
         return jsonify({'error': 'No image uploaded'}), 400
     image = request.files['image']
     try:
+        run_gate('bone_fracture', image.stream)
         img_array = preprocess_bone_fracture_image(image.stream)
         # Match model's expected channels if needed
         expected_channels = bone_fracture_model.input_shape[-1]
         if expected_channels != img_array.shape[-1]:
             img_array = np.repeat(img_array, expected_channels, axis=-1)
         
-        predictions = bone_fracture_model.predict(img_array)
+        predictions = run_model('bone_fracture', img_array)
         prediction_value = float(predictions[0][0])
         predicted_class_index = 1 if prediction_value >= 0.5 else 0
         predicted_class_name = bone_fracture_names.get(predicted_class_index, "Unknown")
         
-        return jsonify({
+        return prediction_response({
             'prediction': predicted_class_name,
             'is_disease_present': predicted_class_index == 1,
-            'confidence': prediction_value if predicted_class_index == 1 else 1 - prediction_value,
-            'raw': predictions.tolist()
-        })
+            'confidence': prediction_value if predicted_class_index == 1 else 1 - prediction_value
+        }, predictions)
+    except GateRejected as e:
+        return jsonify({'error': str(e), 'gate': e.stats}), e.status_code
+    except SchedulerError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error in bone fracture prediction: {str(e)}")  # For debugging
         return jsonify({'error': str(e)}), 500
@@ -325,18 +472,22 @@ def predict_anemia():
         return jsonify({'error': 'No image uploaded'}), 400
     image = request.files['image']
     try:
+        run_gate('anemia', image.stream)
         img_array = preprocess_anemia_image(image.stream)
-        predictions = anemia_model.predict(img_array)
+        predictions = run_model('anemia', img_array)
         prediction_value = float(predictions[0][0])
         predicted_class_index = 1 if prediction_value >= 0.5 else 0
         predicted_class_name = anemia_names.get(predicted_class_index, "Unknown")
         
-        return jsonify({
+        return prediction_response({
             'prediction': predicted_class_name,
             'is_disease_present': predicted_class_index == 1,
-            'confidence': prediction_value if predicted_class_index == 1 else 1 - prediction_value,
-            'raw': predictions.tolist()
-        })
+            'confidence': prediction_value if predicted_class_index == 1 else 1 - prediction_value
+        }, predictions)
+    except GateRejected as e:
+        return jsonify({'error': str(e), 'gate': e.stats}), e.status_code
+    except SchedulerError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error in anemia prediction: {str(e)}")  # For debugging
         return jsonify({'error': str(e)}), 500
@@ -348,22 +499,96 @@ def predict_skin_cancer():
         return jsonify({'error': 'No image uploaded'}), 400
     image = request.files['image']
     try:
-        img_array = preprocess_skin_cancer_image(image.stream)
-        predictions = skin_cancer_model.predict(img_array)
+        if tiled_mode_requested():
+            # Refuse oversized tiled uploads from the header, before the gate decodes anything
+            check_tiling_size(image.stream)
+        run_gate('skin_cancer', image.stream)
+        tiled = None
+        if tiled_mode_requested():
+            tiled = run_tiled_model('skin_cancer', image.stream)
+            predictions = np.array([[tiled['score']]], dtype='float32')
+        else:
+            img_array = preprocess_skin_cancer_image(image.stream)
+            predictions = run_model('skin_cancer', img_array)
         prediction_value = float(predictions[0][0])
         predicted_class_index = 1 if prediction_value >= 0.5 else 0
         predicted_class_name = skin_cancer_names.get(predicted_class_index, "Unknown")
         
-        return jsonify({
+        result = {
             'prediction': predicted_class_name,
             'is_disease_present': predicted_class_index == 1,
-            'confidence': prediction_value if predicted_class_index == 1 else 1 - prediction_value,
-            'raw': predictions.tolist()
-        })
+            'confidence': prediction_value if predicted_class_index == 1 else 1 - prediction_value
+        }
+        if tiled:
+            # Image-level score, coarse per-tile heatmap and tile counts
+            result['tiled'] = tiled
+        return prediction_response(result, predictions)
+    except GateRejected as e:
+        return jsonify({'error': str(e), 'gate': e.stats}), e.status_code
+    except ImageTooLarge as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except SchedulerError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error in skin cancer prediction: {str(e)}")  # For debugging
         return jsonify({'error': str(e)}), 500
 
+PREPROCESSORS = {
+    'brain_tumor': preprocess_brain_tumor_image,
+    'breast_cancer': preprocess_breast_cancer_image,
+    'pneumonia': preprocess_pneumonia_image,
+    'bone_fracture': preprocess_bone_fracture_image,
+    'anemia': preprocess_anemia_image,
+    'skin_cancer': preprocess_skin_cancer_image,
+}
+
+# Similar prior cases endpoint
+@app.route('/similar/<model_key>', methods=['POST'])
+def similar_cases(model_key):
+    if model_key not in models:
+        return jsonify({'error': f'Unknown model: {model_key}'}), 404
+    if 'image' not in request.files:
+        return jsonify({'error': 'No image uploaded'}), 400
+    image = request.files['image']
+    try:
+        k = max(1, min(request.args.get('k', 5, type=int), MAX_SIMILAR_CASES))
+        run_gate(model_key, image.stream)
+        img_array = PREPROCESSORS[model_key](image.stream)
+        # Match model's expected channels if needed
+        expected_channels = models[model_key].input_shape[-1]
+        if expected_channels != img_array.shape[-1]:
+            img_array = np.repeat(img_array, expected_channels, axis=-1)
+
+        run_model(model_key, img_array)
+        _, embedding = g.embedding
+        started = time.perf_counter()
+        matches = similarity_indexes[model_key].search(embedding, k)
+        return jsonify({
+            'model': model_key,
+            'matches': matches,
+            'indexed_cases': len(similarity_indexes[model_key]),
+            'search_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+    except GateRejected as e:
+        return jsonify({'error': str(e), 'gate': e.stats}), e.status_code
+    except SchedulerError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        print(f"Error in similar case search: {str(e)}")  # For debugging
+        return jsonify({'error': str(e)}), 500
+
+# Prediction-quality and drift monitoring, e.g. /monitor/pneumonia?window=15m
+@app.route('/monitor', methods=['GET'])
+@app.route('/monitor/<model_key>', methods=['GET'])
+def monitor_stats(model_key=None):
+    if model_key is not None and model_key not in models:
+        return jsonify({'error': f'Unknown model: {model_key}'}), 404
+    return jsonify(monitor.snapshot(model_key, parse_window(request.args.get('window'))))
+
+@app.route('/scheduler', methods=['GET'])
+def scheduler_stats():
+    return jsonify(scheduler.snapshot())
+
 @app.route('/')
 def index():
     return 'ML Disease Prediction API is running.'
@@ -0,0 +1,220 @@
+"""
+Micro-benchmarks for the ML API request path.
+
+Run from the ml_api directory:
+    python benchmark.py                  # all sections
+    python benchmark.py serialization    # one section
+"""
+import argparse
+import io
+import json
+import os
+import time
+import timeit
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from gate import GATE_MAX_DECODE_PIXELS, GateRejected, check_image
+from serialization import encode_json, encode_msgpack, msgpack, orjson
+from monitor import PredictionMonitor
+from tta import augment_batch
+
+BRAIN_TUMOR_MODEL_PATH = '../ml_models/Brain_Tumor.h5'
+
+
+def time_call(fn, number):
+    """Best-of-5 mean time per call in microseconds."""
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def bench_serialization(args, number=2000):
+    """Encode time and payload size for each response format."""
+    rng = np.random.default_rng(0)
+    cases = {
+        'single binary (1x1)': rng.random((1, 1), dtype=np.float32),
+        'single 4-class (1x4)': rng.random((1, 4), dtype=np.float32),
+        'batch 4-class (256x4)': rng.random((256, 4), dtype=np.float32),
+    }
+    payload = {'prediction': 'Glioma', 'is_disease_present': True, 'confidence': 0.9731}
+
+    print("Serialization")
+    print(f"  {'case':<24} {'encoder':<22} {'us/call':>10} {'bytes':>8}")
+    for case, raw in cases.items():
+        encoders = {
+            # What the endpoints did before: Flask's stock jsonify with raw.tolist()
+            'stock json + raw': lambda: json.dumps(dict(payload, raw=raw.tolist())).encode('utf-8'),
+            'compact (default)': lambda: encode_json(payload),
+            'fast json + raw': lambda: encode_json(payload, raw),
+        }
+        if msgpack is not None:
+            encoders['msgpack + raw'] = lambda: encode_msgpack(payload, raw)
+        for name, fn in encoders.items():
+            print(f"  {case:<24} {name:<22} {time_call(fn, number):>10.2f} {len(fn()):>8}")
+    if orjson is None:
+        print("  (orjson not installed: 'fast json' is the stdlib fallback)")
+    if msgpack is None:
+        print("  (msgpack not installed: binary format skipped)")
+    print()
+
+
+def encode_image(array, fmt):
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def synthetic_images(rng, size=512):
+    """One synthetic upload per kind: (kind, in_distribution_for_brain_tumor, bytes)."""
+    yy, xx = np.mgrid[0:size, 0:size]
+    scan = np.clip(128 + 80 * np.sin(xx / 40) * np.cos(yy / 55) + rng.normal(0, 20, (size, size)), 0, 255)
+    mri = scan.astype(np.uint8)
+    mri[(xx - size // 2) ** 2 + (yy - size // 2) ** 2 > (size * 0.4) ** 2] = 0
+    photo = np.stack([
+        150 + 60 * np.sin(xx / 30), 100 + 40 * np.cos(yy / 25), np.full((size, size), 90.0),
+    ], axis=-1) + rng.normal(0, 15, (size, size, 3))
+    photo = np.clip(photo, 0, 255).astype(np.uint8)
+    screenshot = Image.new('RGB', (size * 3 // 2, size), (240, 240, 240))
+    draw = ImageDraw.Draw(screenshot)
+    draw.rectangle((0, 0, size * 3 // 2, 60), fill=(40, 90, 160))
+    draw.rectangle((40, 90, size * 3 // 2 - 40, size - 40), fill=(200, 210, 220))
+    for line in range(size // 25):
+        draw.text((50, 100 + line * 20), "Patient report lorem ipsum dolor sit amet", fill=(20, 20, 20))
+    # Full-resolution X-ray export, the usual PNG size from a PACS (about 5 MP)
+    xy, xx = np.mgrid[0:2500, 0:2048]
+    xray = np.clip(110 + 70 * np.sin(xx / 300) * np.cos(xy / 350) + rng.normal(0, 12, xx.shape), 0, 255)
+    return [
+        ('mri (jpeg)', True, encode_image(mri, 'JPEG')),
+        ('mri (png)', True, encode_image(mri, 'PNG')),
+        ('x-ray 2048x2500 (png)', True, encode_image(xray.astype(np.uint8), 'PNG')),
+        ('photo (jpeg)', False, encode_image(photo, 'JPEG')),
+        ('screenshot (png)', False, encode_image(np.asarray(screenshot), 'PNG')),
+    ]
+
+
+def model_forward_ms(args, batch_size=1):
+    """
+    Measured brain tumor forward pass for `batch_size` images if the model is
+    available, else --model-ms per image (an upper bound for batches).
+    """
+    if os.path.exists(BRAIN_TUMOR_MODEL_PATH):
+        try:
+            from tensorflow.keras.models import load_model
+            model = load_model(BRAIN_TUMOR_MODEL_PATH)
+            batch = np.zeros((batch_size,) + tuple(model.input_shape[1:]), dtype='float32')
+            model.predict(batch, verbose=0)
+            return time_call(lambda: model.predict(batch, verbose=0), 10) / 1000, 'measured'
+        except Exception as e:
+            print(f"  (could not run {BRAIN_TUMOR_MODEL_PATH}: {e})")
+    return args.model_ms * batch_size, 'assumed, set with --model-ms'
+
+
+def bench_gate(args, number=50):
+    """Inference time saved by the cascade gate on a mixed synthetic workload."""
+    rng = np.random.default_rng(0)
+    images = synthetic_images(rng)
+    forward_ms, source = model_forward_ms(args)
+
+    print("Cascade gate (brain_tumor profile)")
+    print(f"  {'upload':<22} {'gate ms':>8} {'decision':>10}")
+    gate_ms = {}
+    accepted = {}
+    for kind, in_distribution, data in images:
+        def run():
+            try:
+                stats = check_image('brain_tumor', io.BytesIO(data))
+                return 'skipped' if 'skipped' in stats else 'accepted'
+            except GateRejected:
+                return 'rejected'
+        gate_ms[kind] = time_call(run, number) / 1000
+        decision = run()
+        accepted[kind] = decision != 'rejected'
+        flag = '' if accepted[kind] == in_distribution else '  <- wrong'
+        print(f"  {kind:<22} {gate_ms[kind]:>8.3f} {decision:>10}{flag}")
+    print(f"  (non-JPEG uploads above {GATE_MAX_DECODE_PIXELS} pixels skip the gate instead of a full decode)")
+
+    # Mixed workload: args.ood_fraction of uploads are wrong-modality, each
+    # handled according to the gate's measured decision for its kind
+    n = 1000
+    n_ood = int(n * args.ood_fraction)
+    in_distribution = {kind: good for kind, good, _ in images}
+    ood_kinds = [kind for kind, good in in_distribution.items() if not good]
+    good_kinds = [kind for kind, good in in_distribution.items() if good]
+    workload = list(rng.choice(ood_kinds, n_ood)) + list(rng.choice(good_kinds, n - n_ood))
+    false_rejects = sum(1 for kind in workload if in_distribution[kind] and not accepted[kind])
+    false_accepts = sum(1 for kind in workload if not in_distribution[kind] and accepted[kind])
+    without_gate = n * forward_ms
+    # A wrongly rejected scan still needs its forward pass (retried with
+    # ?gate=off), so it is charged in full rather than counted as saved
+    with_gate = sum(
+        gate_ms[kind] + (forward_ms if accepted[kind] or in_distribution[kind] else 0)
+        for kind in workload
+    )
+    print(f"  model forward pass: {forward_ms:.1f} ms ({source})")
+    print(f"  {n} uploads, {args.ood_fraction:.0%} out-of-distribution:")
+    print(f"    without gate {without_gate / 1000:8.2f} s")
+    print(f"    with gate    {with_gate / 1000:8.2f} s  ({1 - with_gate / without_gate:.1%} saved)")
+    print(f"    wrongly rejected scans:   {false_rejects} ({false_rejects / max(n - n_ood, 1):.1%} of in-distribution)")
+    print(f"    wrongly accepted uploads: {false_accepts} ({false_accepts / max(n_ood, 1):.1%} of out-of-distribution)")
+    print()
+
+
+def bench_tta(args, number=20):
+    """Cost of building the augmented batch and the average latency TTA adds."""
+    rng = np.random.default_rng(0)
+    print("Test-time augmentation")
+    augment_ms = {}
+    for channels in (1, 3):
+        img_array = rng.random((1, 224, 224, channels), dtype=np.float32)
+        augment_ms[channels] = time_call(lambda: augment_batch(img_array), number) / 1000
+        views = len(augment_batch(img_array))
+        print(f"  build {views} views (224x224x{channels}): {augment_ms[channels]:.2f} ms")
+
+    batch_ms, source = model_forward_ms(args, batch_size=views)
+    extra_ms = augment_ms[3] + batch_ms
+    print(f"  extra forward pass on {views} views: {batch_ms:.1f} ms ({source})")
+    print("  average added latency by share of borderline first passes (early exit for the rest):")
+    for borderline in (0.05, 0.1, 0.25, 0.5):
+        print(f"    {borderline:>4.0%} borderline -> +{borderline * extra_ms:6.1f} ms/request")
+    print()
+
+
+def bench_monitor(args, number=10000):
+    """Request-path cost of monitor.record versus the off-path aggregation it defers."""
+    rng = np.random.default_rng(0)
+    img_array = rng.random((1, 224, 224, 3), dtype=np.float32)
+    # Long flush interval so the background thread does not interfere
+    monitor = PredictionMonitor(flush_interval=3600)
+    record_us = time_call(lambda: monitor.record('pneumonia', 'Pneumonia', 0.87, img_array), number)
+    for _ in range(number):
+        monitor.record('pneumonia', 'Pneumonia', 0.87, img_array)
+    started = time.perf_counter()
+    monitor.flush()
+    flush_us = (time.perf_counter() - started) / number * 1e6
+    print("Monitoring")
+    print(f"  record (request path):  {record_us:6.2f} us/prediction")
+    print(f"  flush (background):     {flush_us:6.2f} us/prediction")
+    print()
+
+
+SECTIONS = {
+    'serialization': bench_serialization,
+    'gate': bench_gate,
+    'tta': bench_tta,
+    'monitor': bench_monitor,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sections', nargs='*', help=f"Sections to run (default: all): {', '.join(SECTIONS)}")
+    parser.add_argument('--model-ms', type=float, default=150.0,
+                        help="Forward pass cost to assume when the model file is not available")
+    parser.add_argument('--ood-fraction', type=float, default=0.2,
+                        help="Share of out-of-distribution uploads in the gate workload")
+    args = parser.parse_args()
+    unknown = set(args.sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"unknown section(s): {', '.join(sorted(unknown))}")
+    for name in args.sections or SECTIONS:
+        SECTIONS[name](args)
@@ -0,0 +1,145 @@
+"""
+Cheap pre-check that rejects uploads that do not look like the modality a
+model expects (photos sent to an X-ray model, screenshots, blank images)
+before the expensive CNN forward pass.
+
+Checks run on a 64x64 thumbnail. JPEGs are reduced while decoding (draft
+mode), so even large JPEG uploads cost a few milliseconds. Other formats
+(PNG, BMP, TIFF) have to be decoded at full size; that costs roughly
+50-100 ms for a 2000x2000 PNG, on the order of the forward pass the gate is
+meant to save. The gate therefore only decodes images of at most
+GATE_MAX_DECODE_PIXELS and skips the check (accepting the upload) above
+that, deciding from the header alone. A tiny classifier per model can be
+added by dropping a Keras file at GATE_CLASSIFIER_PATHS[model]; it is used
+when present.
+"""
+import os
+
+import numpy as np
+from PIL import Image
+
+THUMB_SIZE = (64, 64)
+# Largest non-JPEG image the gate will decode; bigger ones skip the gate
+GATE_MAX_DECODE_PIXELS = 1024 * 1024
+
+# Per-model expectations, keyed like MODEL_PATHS in app.py.
+# max_chroma: X-ray/MRI models expect (near) grayscale input
+# min_chroma: histopathology and dermatoscopy models expect colour input
+GATE_PROFILES = {
+    'brain_tumor': {'modality': 'an MRI scan', 'max_chroma': 0.06},
+    'pneumonia': {'modality': 'a chest X-ray', 'max_chroma': 0.06},
+    'bone_fracture': {'modality': 'an X-ray', 'max_chroma': 0.06},
+    'breast_cancer': {'modality': 'a histopathology image', 'min_chroma': 0.04},
+    'skin_cancer': {'modality': 'a skin lesion photo', 'min_chroma': 0.04},
+    'anemia': {'modality': 'an anemia image'},
+}
+
+# Thresholds shared by every profile
+MIN_INTENSITY_STD = 0.02       # below this the image is essentially blank
+MAX_FLAT_FRACTION = 0.5        # screenshots: mid-tone pixels dominated by a few exact colours
+MIN_MIDTONE_FRACTION = 0.1     # flat-colour check needs enough non-black/white pixels
+
+GATE_CLASSIFIER_PATHS = {
+    name: f'../ml_models/gates/{name}_gate.keras' for name in GATE_PROFILES
+}
+GATE_CLASSIFIER_THRESHOLD = 0.5
+
+_gate_classifiers = {}
+
+
+class GateRejected(Exception):
+    status_code = 422
+
+    def __init__(self, message, stats=None):
+        super().__init__(message)
+        self.stats = stats or {}
+
+
+def load_thumbnail(image_stream, size=THUMB_SIZE):
+    """
+    Decode a small RGB uint8 thumbnail and rewind the stream for the real
+    preprocessing. Returns None, without decoding, when the image would
+    have to be decoded above GATE_MAX_DECODE_PIXELS.
+    """
+    try:
+        image = Image.open(image_stream)
+        # JPEG decodes at 1/2..1/8 scale in draft mode, skipping most of the work
+        image.draft('RGB', (size[0] * 2, size[1] * 2))
+        # Draft-reduced JPEGs are cheap whatever their size; other formats are not
+        if image.format != 'JPEG' and image.size[0] * image.size[1] > GATE_MAX_DECODE_PIXELS:
+            return None
+        # NEAREST keeps exact pixel values so flat UI colours stay flat
+        thumb = np.asarray(image.convert('RGB').resize(size, Image.NEAREST))
+    except Exception as e:
+        raise GateRejected(f"Uploaded file is not a readable image: {str(e)}")
+    finally:
+        image_stream.seek(0)
+    return thumb
+
+
+def image_stats(thumb):
+    """Fast modality statistics on an RGB uint8 thumbnail."""
+    pixels = thumb.reshape(-1, 3)
+    rgb = pixels.astype(np.float32) / 255.0
+    luminance = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    chroma = rgb.max(axis=1) - rgb.min(axis=1)
+
+    midtone = (luminance > 0.06) & (luminance < 0.94)
+    midtone_fraction = float(midtone.mean())
+    flat_fraction = 0.0
+    if midtone.any():
+        packed = pixels[midtone].astype(np.int32) @ np.array([65536, 256, 1], dtype=np.int32)
+        counts = np.unique(packed, return_counts=True)[1]
+        flat_fraction = float(np.sort(counts)[-4:].sum() / packed.size)
+
+    return {
+        'chroma': float(chroma.mean()),
+        'intensity_mean': float(luminance.mean()),
+        'intensity_std': float(luminance.std()),
+        'midtone_fraction': midtone_fraction,
+        'flat_fraction': flat_fraction,
+    }
+
+
+def gate_classifier(model_key):
+    """Optional tiny in-distribution classifier, loaded once if its file exists."""
+    if model_key not in _gate_classifiers:
+        path = GATE_CLASSIFIER_PATHS.get(model_key)
+        classifier = None
+        if path and os.path.exists(path):
+            from tensorflow.keras.models import load_model
+            classifier = load_model(path)
+        _gate_classifiers[model_key] = classifier
+    return _gate_classifiers[model_key]
+
+
+def check_image(model_key, image_stream):
+    """
+    Raise GateRejected if the upload does not look like input for `model_key`.
+    Returns the computed statistics otherwise.
+    """
+    profile = GATE_PROFILES[model_key]
+    modality = profile['modality']
+    thumb = load_thumbnail(image_stream)
+    if thumb is None:
+        return {'skipped': 'image too large to check cheaply'}
+    stats = image_stats(thumb)
+
+    if stats['intensity_std'] < MIN_INTENSITY_STD:
+        raise GateRejected("Image is blank or nearly uniform", stats)
+    if stats['midtone_fraction'] >= MIN_MIDTONE_FRACTION and stats['flat_fraction'] > MAX_FLAT_FRACTION:
+        raise GateRejected(f"Image looks like a screenshot or graphic, not {modality}", stats)
+    if 'max_chroma' in profile and stats['chroma'] > profile['max_chroma']:
+        raise GateRejected(f"Image is in colour, but this model expects {modality} (grayscale)", stats)
+    if 'min_chroma' in profile and stats['chroma'] < profile['min_chroma']:
+        raise GateRejected(f"Image is grayscale, but this model expects {modality} (colour)", stats)
+
+    classifier = gate_classifier(model_key)
+    if classifier is not None:
+        height, width = classifier.input_shape[1:3]
+        thumb = load_thumbnail(image_stream, (width, height))
+        score = float(classifier(thumb[np.newaxis].astype('float32') / 255.0, training=False)[0][0])
+        stats['classifier_score'] = score
+        if score < GATE_CLASSIFIER_THRESHOLD:
+            raise GateRejected(f"Image does not look like {modality}", stats)
+    return stats
@@ -0,0 +1,217 @@
+"""
+Streaming prediction-quality and drift statistics per model, in constant memory.
+
+The request path only appends a tuple to a deque (atomic under the GIL, no
+lock). A background thread drains the deque in batches and folds the
+entries into a ring of fixed-size time buckets per model:
+
+  - a fixed-bin histogram of confidence (quantiles are read from it)
+  - counts per predicted class
+  - per-image mean intensity of the preprocessed input (count, sum, sum of
+    squares, min, max) and mean contrast, computed on a small strided copy
+
+Windowed views sum the buckets that fall inside the window; lifetime totals
+are kept alongside.
+"""
+import collections
+import logging
+import threading
+import time
+
+import numpy as np
+
+BUCKET_SECONDS = 60
+BUCKETS = 60
+CONFIDENCE_BINS = 20
+FLUSH_INTERVAL = 1.0
+# Pending entries beyond this are dropped (oldest first) if the aggregator falls behind
+MAX_PENDING = 10000
+# Intensity is sampled on a grid of at most INTENSITY_SAMPLE x INTENSITY_SAMPLE
+# pixels (every 8th pixel of a 224x224 input)
+INTENSITY_SAMPLE = 28
+
+QUANTILES = (0.1, 0.5, 0.9)
+
+logger = logging.getLogger(__name__)
+
+
+class ModelStats:
+    """Bucket ring and lifetime totals for one model."""
+
+    def __init__(self):
+        self.slots = np.full(BUCKETS, -1, dtype=np.int64)
+        self.confidence = np.zeros((BUCKETS, CONFIDENCE_BINS), dtype=np.int64)
+        # intensity columns: n, sum, sum of squares, contrast sum
+        self.intensity = np.zeros((BUCKETS, 4), dtype=np.float64)
+        self.intensity_min = np.full(BUCKETS, np.inf)
+        self.intensity_max = np.full(BUCKETS, -np.inf)
+        self.classes = {}
+        self.lifetime_confidence = np.zeros(CONFIDENCE_BINS, dtype=np.int64)
+        self.lifetime_classes = collections.Counter()
+
+    def _bucket(self, slot):
+        i = slot % BUCKETS
+        if self.slots[i] != slot:
+            # Reuse the ring position of a bucket that has aged out
+            self.slots[i] = slot
+            self.confidence[i] = 0
+            self.intensity[i] = 0
+            self.intensity_min[i] = np.inf
+            self.intensity_max[i] = -np.inf
+            for counts in self.classes.values():
+                counts[i] = 0
+        return i
+
+    def add(self, slot, confidence, label, intensity):
+        i = self._bucket(slot)
+        bin_index = min(int(confidence * CONFIDENCE_BINS), CONFIDENCE_BINS - 1)
+        self.confidence[i, bin_index] += 1
+        self.lifetime_confidence[bin_index] += 1
+        if label not in self.classes:
+            self.classes[label] = np.zeros(BUCKETS, dtype=np.int64)
+        self.classes[label][i] += 1
+        self.lifetime_classes[label] += 1
+        if intensity is not None:
+            mean, contrast = intensity
+            self.intensity[i] += (1, mean, mean * mean, contrast)
+            self.intensity_min[i] = min(self.intensity_min[i], mean)
+            self.intensity_max[i] = max(self.intensity_max[i], mean)
+
+    def view(self, since_slot):
+        live = self.slots >= since_slot
+        histogram = self.confidence[live].sum(axis=0)
+        count = int(histogram.sum())
+        n, total, total_sq, contrast = self.intensity[live].sum(axis=0)
+        intensity = None
+        if n:
+            mean = total / n
+            intensity = {
+                'images': int(n),
+                'mean': round(float(mean), 4),
+                'std': round(float(np.sqrt(max(total_sq / n - mean * mean, 0.0))), 4),
+                'min': round(float(self.intensity_min[live].min()), 4),
+                'max': round(float(self.intensity_max[live].max()), 4),
+                'contrast_mean': round(float(contrast / n), 4),
+            }
+        class_counts = {label: int(counts[live].sum()) for label, counts in self.classes.items()}
+        return {
+            'predictions': count,
+            'confidence': confidence_summary(histogram),
+            'class_rates': {label: round(c / count, 4) for label, c in class_counts.items() if c} if count else {},
+            'intensity': intensity,
+        }
+
+    def lifetime(self):
+        count = int(self.lifetime_confidence.sum())
+        return {
+            'predictions': count,
+            'confidence': confidence_summary(self.lifetime_confidence),
+            'class_rates': {label: round(c / count, 4) for label, c in self.lifetime_classes.items()} if count else {},
+        }
+
+
+def confidence_summary(histogram):
+    """Mean and quantiles estimated from a fixed-bin confidence histogram."""
+    count = histogram.sum()
+    if not count:
+        return None
+    edges = np.linspace(0.0, 1.0, CONFIDENCE_BINS + 1)
+    centres = (edges[:-1] + edges[1:]) / 2
+    cumulative = np.cumsum(histogram) / count
+    summary = {'mean': round(float((histogram * centres).sum() / count), 4)}
+    for q in QUANTILES:
+        # Linear interpolation inside the bin where the cumulative share crosses q
+        b = int(np.searchsorted(cumulative, q))
+        below = cumulative[b - 1] if b else 0.0
+        within = (q - below) / max(cumulative[b] - below, 1e-12)
+        summary[f'p{int(q * 100)}'] = round(float(edges[b] + within * (edges[b + 1] - edges[b])), 4)
+    summary['histogram'] = histogram.tolist()
+    return summary
+
+
+def intensity_stats(model_input):
+    """(mean, std) of a strided sample of a preprocessed input, scaled to [0, 1]."""
+    sample = np.asarray(model_input, dtype=np.float32)
+    if np.issubdtype(np.asarray(model_input).dtype, np.integer):
+        sample = sample / 255.0
+    return float(sample.mean()), float(sample.std())
+
+
+class PredictionMonitor:
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self._pending = collections.deque(maxlen=MAX_PENDING)
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._flush_interval = flush_interval
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def record(self, model_key, label, confidence, model_input=None):
+        """
+        Request-path hook: O(1), no lock. `model_input` is the preprocessed
+        array; only a small strided copy of it is queued, so a pending entry
+        never keeps a full image (or its backing file) alive.
+        """
+        sample = None
+        if model_input is not None:
+            # Works for (1, H, W, C) batches and (H, W, C) images alike
+            height, width = model_input.shape[-3:-1]
+            sample = np.array(model_input[
+                ..., ::max(1, height // INTENSITY_SAMPLE), ::max(1, width // INTENSITY_SAMPLE), :
+            ])
+        self._pending.append((time.time(), model_key, label, confidence, sample))
+
+    def _run(self):
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # Monitoring must never take the API down; drop the batch
+                logger.exception("Dropping a batch of monitoring entries")
+
+    def flush(self):
+        """Fold every pending entry into the bucket rings."""
+        entries = []
+        while True:
+            try:
+                entries.append(self._pending.popleft())
+            except IndexError:
+                break
+        if not entries:
+            return
+        with self._lock:
+            for timestamp, model_key, label, confidence, sample in entries:
+                stats = self._stats.get(model_key)
+                if stats is None:
+                    stats = self._stats[model_key] = ModelStats()
+                intensity = intensity_stats(sample) if sample is not None else None
+                stats.add(int(timestamp // BUCKET_SECONDS), float(confidence), label, intensity)
+
+    def snapshot(self, model_key=None, window_seconds=BUCKET_SECONDS * 5):
+        """Windowed and lifetime statistics for one model, or all models."""
+        window_seconds = max(BUCKET_SECONDS, min(window_seconds, BUCKET_SECONDS * BUCKETS))
+        # Current (partial) bucket plus enough whole buckets to cover the window
+        since_slot = int(time.time() // BUCKET_SECONDS) - int(np.ceil(window_seconds / BUCKET_SECONDS)) + 1
+        with self._lock:
+            keys = [model_key] if model_key else sorted(self._stats)
+            return {
+                key: {
+                    'window_seconds': window_seconds,
+                    'window': self._stats[key].view(since_slot),
+                    'lifetime': self._stats[key].lifetime(),
+                }
+                for key in keys if key in self._stats
+            }
+
+
+def parse_window(value, default=BUCKET_SECONDS * 5):
+    """Window like '90s', '5m', '1h' or plain seconds; returns seconds."""
+    if not value:
+        return default
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    try:
+        if value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(float(value))
+    except (ValueError, OverflowError):
+        return default
@@ -0,0 +1,172 @@
+"""
+Priority- and deadline-aware admission control for model execution.
+
+Flask serves each request on its own thread; before running a model the
+request asks the scheduler for an inference slot. Waiting requests are
+admitted by priority class first and earliest deadline second, each class
+is capped at its own concurrency quota, and requests whose deadline passes
+while queued are dropped before any model work is done.
+
+Priority comes from the API key (ML_API_KEY_PRIORITIES="key1:urgent,key2:batch")
+when one is configured, otherwise from the X-Priority header, otherwise
+'normal'. X-Deadline-Ms sets a per-request time budget in milliseconds.
+"""
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# rank: lower is admitted first
+# max_concurrent: slots the class may hold at once. Keep normal + batch below
+#   MAX_CONCURRENT_INFERENCES so urgent requests always find a free slot.
+# max_queued: waiting requests beyond this are rejected immediately
+# default_deadline_ms: budget when the request does not send X-Deadline-Ms
+# max_deadline_ms: X-Deadline-Ms values above this are clamped to it
+PRIORITY_CLASSES = {
+    'urgent': {'rank': 0, 'max_concurrent': 4, 'max_queued': 64, 'default_deadline_ms': 10000, 'max_deadline_ms': 60000},
+    'normal': {'rank': 1, 'max_concurrent': 2, 'max_queued': 64, 'default_deadline_ms': 30000, 'max_deadline_ms': 120000},
+    'batch': {'rank': 2, 'max_concurrent': 1, 'max_queued': 1024, 'default_deadline_ms': 600000, 'max_deadline_ms': 3600000},
+}
+DEFAULT_PRIORITY = 'normal'
+MAX_CONCURRENT_INFERENCES = int(os.environ.get('ML_MAX_CONCURRENT_INFERENCES', 4))
+
+
+class SchedulerError(Exception):
+    status_code = 503
+
+
+class DeadlineExceeded(SchedulerError):
+    status_code = 504
+
+
+class SchedulerBusy(SchedulerError):
+    status_code = 503
+
+
+def parse_api_key_priorities(value):
+    """Parse "key:class,key:class" into a dict, ignoring unknown classes."""
+    priorities = {}
+    for entry in (value or '').split(','):
+        key, _, priority = entry.strip().partition(':')
+        if key and priority in PRIORITY_CLASSES:
+            priorities[key] = priority
+    return priorities
+
+
+API_KEY_PRIORITIES = parse_api_key_priorities(os.environ.get('ML_API_KEY_PRIORITIES'))
+
+
+def request_priority(req):
+    api_key = req.headers.get('X-API-Key')
+    if api_key in API_KEY_PRIORITIES:
+        return API_KEY_PRIORITIES[api_key]
+    priority = (req.headers.get('X-Priority') or '').lower()
+    return priority if priority in PRIORITY_CLASSES else DEFAULT_PRIORITY
+
+
+def request_deadline(req, priority, started):
+    """Absolute time.monotonic() deadline for a request that arrived at `started`."""
+    limits = PRIORITY_CLASSES[priority]
+    budget_ms = limits['default_deadline_ms']
+    header = req.headers.get('X-Deadline-Ms')
+    if header:
+        try:
+            value = float(header)
+        except ValueError:
+            value = None
+        # nan, inf and non-positive budgets fall back to the class default
+        if value is not None and math.isfinite(value) and value > 0:
+            budget_ms = min(value, limits['max_deadline_ms'])
+    return started + budget_ms / 1000.0
+
+
+class _Waiter:
+    """One queued request; woken individually when it is admitted."""
+    __slots__ = ('priority', 'event', 'admitted', 'cancelled')
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.event = threading.Event()
+        self.admitted = False
+        self.cancelled = False
+
+
+class InferenceScheduler:
+    def __init__(self, max_concurrent=MAX_CONCURRENT_INFERENCES, classes=PRIORITY_CLASSES):
+        self.max_concurrent = max_concurrent
+        self.classes = classes
+        self._ranked = sorted(classes, key=lambda name: classes[name]['rank'])
+        self._lock = threading.Lock()
+        # Per-class heap of (deadline, seq, waiter); expired waiters are
+        # marked cancelled and skipped when they reach the head
+        self._waiting = {name: [] for name in classes}
+        self._seq = itertools.count()
+        self._running = {name: 0 for name in classes}
+        self._queued = {name: 0 for name in classes}
+        self._stats = {name: {'admitted': 0, 'expired': 0, 'rejected': 0} for name in classes}
+
+    def _dispatch(self):
+        """
+        Hand free slots to the heads of the class heaps, best rank first,
+        waking only the waiters that were admitted. Caller holds the lock.
+        """
+        while sum(self._running.values()) < self.max_concurrent:
+            for name in self._ranked:
+                heap = self._waiting[name]
+                while heap and heap[0][2].cancelled:
+                    heapq.heappop(heap)
+                if heap and self._running[name] < self.classes[name]['max_concurrent']:
+                    waiter = heapq.heappop(heap)[2]
+                    self._queued[name] -= 1
+                    self._running[name] += 1
+                    self._stats[name]['admitted'] += 1
+                    waiter.admitted = True
+                    waiter.event.set()
+                    break
+            else:
+                return
+
+    def acquire(self, priority, deadline):
+        with self._lock:
+            if time.monotonic() >= deadline:
+                self._stats[priority]['expired'] += 1
+                raise DeadlineExceeded("Request deadline passed before inference started")
+            if self._queued[priority] >= self.classes[priority]['max_queued']:
+                self._stats[priority]['rejected'] += 1
+                raise SchedulerBusy(f"Too many queued '{priority}' requests, try again later")
+            waiter = _Waiter(priority)
+            heapq.heappush(self._waiting[priority], (deadline, next(self._seq), waiter))
+            self._queued[priority] += 1
+            self._dispatch()
+
+        waiter.event.wait(max(deadline - time.monotonic(), 0))
+        with self._lock:
+            if waiter.admitted:
+                return
+            waiter.cancelled = True
+            self._queued[priority] -= 1
+            self._stats[priority]['expired'] += 1
+        raise DeadlineExceeded("Request deadline passed while waiting for inference")
+
+    def release(self, priority):
+        with self._lock:
+            self._running[priority] -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority, deadline):
+        self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: dict(self._stats[name], running=self._running[name], queued=self._queued[name])
+                for name in self.classes
+            }
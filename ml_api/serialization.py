@@ -0,0 +1,94 @@
+"""
+Response encoding for the /predict/* endpoints.
+
+Clients pick a format with the Accept header or the `format` query flag:
+  - application/json (default): label and confidence only; `?raw=1` adds
+    the model's output vector.
+  - application/x-msgpack: MessagePack with the raw output always included
+    as a packed NumPy buffer, for batch clients that want full probabilities.
+"""
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+# Query flag values accepted for ?format=
+FORMAT_ALIASES = {
+    'json': JSON_MIMETYPE,
+    'msgpack': MSGPACK_MIMETYPE,
+}
+
+TRUTHY = ('1', 'true', 'yes')
+
+
+def available_mimetypes():
+    mimetypes = [JSON_MIMETYPE]
+    if msgpack is not None:
+        mimetypes.append(MSGPACK_MIMETYPE)
+    return mimetypes
+
+
+def choose_format(req):
+    """
+    Pick the response mimetype and whether to include raw outputs.
+    Returns (mimetype, include_raw), or (None, False) if the client asked
+    explicitly for a format this server cannot produce.
+    """
+    requested = req.args.get('format')
+    if requested:
+        mimetype = FORMAT_ALIASES.get(requested.lower())
+        if mimetype not in available_mimetypes():
+            return None, False
+    else:
+        # JSON comes first so `*/*` and missing Accept headers get JSON
+        mimetype = req.accept_mimetypes.best_match(available_mimetypes(), default=JSON_MIMETYPE)
+
+    if mimetype == MSGPACK_MIMETYPE:
+        return mimetype, True
+    return mimetype, req.args.get('raw', '').lower() in TRUTHY
+
+
+def pack_array(array):
+    """NumPy array as a MessagePack-friendly dict; rebuild with np.frombuffer(data, dtype).reshape(shape)."""
+    array = np.ascontiguousarray(array)
+    return {
+        'dtype': array.dtype.str,
+        'shape': list(array.shape),
+        'data': array.tobytes(),
+    }
+
+
+def encode_json(payload, raw=None):
+    if orjson is not None:
+        if raw is not None:
+            payload = dict(payload, raw=np.ascontiguousarray(raw))
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    if raw is not None:
+        payload = dict(payload, raw=raw.tolist())
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def encode_msgpack(payload, raw=None):
+    if raw is not None:
+        payload = dict(payload, raw=pack_array(raw))
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def encode_response(payload, raw, mimetype, include_raw):
+    """Serialize a prediction payload, returning the response body bytes."""
+    raw = raw if include_raw else None
+    if mimetype == MSGPACK_MIMETYPE:
+        return encode_msgpack(payload, raw)
+    return encode_json(payload, raw)
@@ -0,0 +1,297 @@
+"""
+Similar-case retrieval from penultimate-layer embeddings.
+
+Each model is wrapped so one forward pass returns both the final prediction
+and the input of its last layer. Embeddings are L2-normalized, optionally
+randomly projected down to EMBEDDING_MAX_DIM, and appended to a per-model
+on-disk index:
+
+    <index_dir>/<model>/
+        state.json        count, dim, capacity, trained list count
+        vectors.f16       float16 embeddings, memory-mapped, grown by doubling
+        lists.i32         inverted-list id of every vector, memory-mapped
+        meta.jsonl        one JSON line of case metadata per vector
+        meta.idx          int64 byte offset of every meta.jsonl line
+        centroids.npy     IVF coarse centroids (once trained)
+        projection.npy    random projection (only for wide embeddings)
+
+Search is exact over all vectors until TRAIN_MIN_VECTORS are stored; after
+that an inverted-file (IVF) index is trained and queries only scan the
+NPROBE lists nearest to the query. Training and retraining run on a
+background thread over a snapshot of the stored vectors; inserts and
+searches keep using the previous lists until the new ones are swapped in.
+
+state.json is rewritten on growth, after training and at most every
+STATE_SAVE_SECONDS. A meta.jsonl line is written last for each insert, so
+rows added after the last save are recovered from it on open.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+EMBEDDING_MAX_DIM = 512
+TRAIN_MIN_VECTORS = 4096
+# Retrain the coarse quantizer when the index has grown this much since training
+RETRAIN_GROWTH = 8
+KMEANS_SAMPLE = 65536
+KMEANS_ITERATIONS = 10
+NPROBE = 8
+INITIAL_CAPACITY = 1024
+SCAN_CHUNK_ROWS = 65536
+STATE_SAVE_SECONDS = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+def build_embedding_model(model):
+    """Keras model returning [penultimate embedding, prediction] in one forward pass."""
+    from tensorflow import keras
+    return keras.Model(inputs=model.inputs, outputs=[model.layers[-1].input, model.output])
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def kmeans(vectors, n_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on normalized float32 vectors; returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty clusters from random points
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class VectorIndex:
+    def __init__(self, path, dim=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._training = False
+        os.makedirs(path, exist_ok=True)
+        state_path = os.path.join(path, 'state.json')
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+        else:
+            self.state = {'count': 0, 'dim': None, 'capacity': 0, 'n_lists': 0, 'trained_at': 0}
+        self.projection = None
+        projection_path = os.path.join(path, 'projection.npy')
+        if os.path.exists(projection_path):
+            self.projection = np.load(projection_path)
+        self.centroids = None
+        if self.state['n_lists']:
+            self.centroids = np.load(os.path.join(path, 'centroids.npy'))
+        self._open_arrays()
+        self._meta_file = open(self._file('meta.jsonl'), 'ab+')
+        self._recover_rows()
+        self._state_saved = time.monotonic()
+        self._build_lists()
+
+    def __len__(self):
+        return self.state['count']
+
+    # -- storage --------------------------------------------------------
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _save_state(self):
+        tmp = self._file('state.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self._file('state.json'))
+        self._state_saved = time.monotonic()
+
+    def _open_arrays(self):
+        capacity, dim = self.state['capacity'], self.state['dim']
+        if not capacity:
+            self.vectors = self.lists = self.meta_offsets = None
+            return
+        self.vectors = np.memmap(self._file('vectors.f16'), dtype=np.float16, mode='r+', shape=(capacity, dim))
+        self.lists = np.memmap(self._file('lists.i32'), dtype=np.int32, mode='r+', shape=(capacity,))
+        self.meta_offsets = np.memmap(self._file('meta.idx'), dtype=np.int64, mode='r+', shape=(capacity,))
+
+    def _recover_rows(self):
+        """Count rows whose meta.jsonl line was written after the last state save."""
+        count, capacity = self.state['count'], self.state['capacity']
+        f = self._meta_file
+        f.seek(0)
+        if count:
+            f.seek(int(self.meta_offsets[count - 1]))
+            f.readline()
+        while count < capacity:
+            offset = f.tell()
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                break
+            self.meta_offsets[count] = offset
+            count += 1
+        if count != self.state['count']:
+            self.state['count'] = count
+            self._save_state()
+
+    def _grow(self, capacity):
+        for name, itemsize in (('vectors.f16', 2 * self.state['dim']), ('lists.i32', 4), ('meta.idx', 8)):
+            with open(self._file(name), 'ab') as f:
+                f.truncate(capacity * itemsize)
+        self.state['capacity'] = capacity
+        self._open_arrays()
+        self._save_state()
+
+    def _init_dim(self, raw_dim):
+        dim = raw_dim
+        if raw_dim > EMBEDDING_MAX_DIM:
+            # Johnson-Lindenstrauss projection keeps cosine similarities roughly intact
+            rng = np.random.default_rng(0)
+            self.projection = (rng.standard_normal((raw_dim, EMBEDDING_MAX_DIM)) / np.sqrt(EMBEDDING_MAX_DIM)).astype(np.float32)
+            np.save(self._file('projection.npy'), self.projection)
+            dim = EMBEDDING_MAX_DIM
+        self.state['dim'] = dim
+        self._grow(INITIAL_CAPACITY)
+
+    def prepare(self, embedding):
+        """Flatten, project and normalize a raw embedding."""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if self.projection is not None:
+            vector = vector @ self.projection
+        return normalize(vector)
+
+    # -- inverted lists -------------------------------------------------
+
+    @staticmethod
+    def _csr(assignments, n_lists):
+        """CSR view of the inverted lists: list c holds order[starts[c]:starts[c + 1]]."""
+        order = np.argsort(assignments, kind='stable').astype(np.int32)
+        return order, np.searchsorted(assignments[order], np.arange(n_lists + 1))
+
+    def _build_lists(self):
+        self._pending = {}
+        if self.centroids is None:
+            self.order = self.starts = None
+            return
+        self.order, self.starts = self._csr(np.asarray(self.lists[:self.state['count']]), len(self.centroids))
+
+    def _start_training(self):
+        """Retrain the coarse quantizer in the background. Caller holds the lock."""
+        self._training = True
+        # Rows below `count` are never rewritten, and a grown index reopens
+        # new memmaps, so this snapshot stays valid without the lock
+        threading.Thread(target=self._train, args=(self.vectors, self.state['count']), daemon=True).start()
+
+    def _train(self, vectors, count):
+        try:
+            n_lists = int(np.clip(4 * np.sqrt(count), 16, 4096))
+            rng = np.random.default_rng(count)
+            sample = np.sort(rng.choice(count, min(count, KMEANS_SAMPLE), replace=False))
+            centroids = kmeans(vectors[sample].astype(np.float32), n_lists)
+            assignments = np.empty(count, dtype=np.int32)
+            for start in range(0, count, SCAN_CHUNK_ROWS):
+                # The memmap spans the whole capacity; only the first `count` rows are snapshotted
+                chunk = vectors[start:min(start + SCAN_CHUNK_ROWS, count)].astype(np.float32)
+                assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+            order, starts = self._csr(assignments, n_lists)
+            tmp = self._file('centroids.tmp.npy')
+            np.save(tmp, centroids)
+
+            with self._lock:
+                # Rows inserted while training go to the pending lists
+                new_count = self.state['count']
+                pending = {}
+                if new_count > count:
+                    tail = self.vectors[count:new_count].astype(np.float32)
+                    tail_assignments = np.argmax(tail @ centroids.T, axis=1)
+                    for row, assigned in enumerate(tail_assignments, start=count):
+                        pending.setdefault(int(assigned), []).append(row)
+                    self.lists[count:new_count] = tail_assignments
+                self.lists[:count] = assignments
+                os.replace(tmp, self._file('centroids.npy'))
+                self.centroids, self.order, self.starts, self._pending = centroids, order, starts, pending
+                self.state['n_lists'] = n_lists
+                self.state['trained_at'] = count
+                self._save_state()
+        except Exception:
+            logger.exception(f"Training the IVF index in {self.path} failed")
+        finally:
+            self._training = False
+
+    # -- public API -----------------------------------------------------
+
+    def add(self, embedding, metadata):
+        """Append one embedding with its case metadata; returns its row id."""
+        with self._lock:
+            if self.state['dim'] is None:
+                self._init_dim(np.asarray(embedding).size)
+            vector = self.prepare(embedding)
+            row = self.state['count']
+            if row >= self.state['capacity']:
+                self._grow(self.state['capacity'] * 2)
+
+            self.vectors[row] = vector
+            if self.centroids is not None:
+                assigned = int(np.argmax(self.centroids @ vector))
+                self.lists[row] = assigned
+                self._pending.setdefault(assigned, []).append(row)
+            # The metadata line goes last: it marks the row as complete
+            self._meta_file.seek(0, os.SEEK_END)
+            self.meta_offsets[row] = self._meta_file.tell()
+            self._meta_file.write((json.dumps(dict(metadata, added=time.time())) + '\n').encode('utf-8'))
+            self._meta_file.flush()
+            self.state['count'] = row + 1
+
+            trained_at = self.state['trained_at']
+            if not self._training and (
+                (not trained_at and row + 1 >= TRAIN_MIN_VECTORS) or (trained_at and row + 1 >= trained_at * RETRAIN_GROWTH)
+            ):
+                self._start_training()
+            if time.monotonic() - self._state_saved >= STATE_SAVE_SECONDS:
+                self._save_state()
+            return row
+
+    def metadata(self, row):
+        """Case metadata of one row. Caller holds the lock (the file handle is shared)."""
+        self._meta_file.seek(int(self.meta_offsets[row]))
+        return json.loads(self._meta_file.readline())
+
+    def _candidates(self, query):
+        if self.centroids is None:
+            return None
+        probes = np.argsort(self.centroids @ query)[-NPROBE:]
+        rows = [self.order[self.starts[c]:self.starts[c + 1]] for c in probes]
+        rows += [np.asarray(self._pending[c], dtype=np.int32) for c in probes if c in self._pending]
+        return np.sort(np.concatenate(rows))
+
+    def search(self, embedding, k=5):
+        """Top-k most similar stored cases as metadata dicts with a cosine `score`."""
+        with self._lock:
+            count = self.state['count']
+            if not count:
+                return []
+            query = self.prepare(embedding)
+            candidates = self._candidates(query)
+            if candidates is None:
+                # Exact scan, chunked so the float32 copy stays small
+                rows = np.arange(count)
+                scores = np.concatenate([
+                    self.vectors[start:min(start + SCAN_CHUNK_ROWS, count)].astype(np.float32) @ query
+                    for start in range(0, count, SCAN_CHUNK_ROWS)
+                ])
+            else:
+                rows = candidates
+                scores = self.vectors[rows].astype(np.float32) @ query
+            k = min(k, len(rows))
+            if not k:
+                return []
+            top = np.argpartition(scores, -k)[-k:]
+            top = top[np.argsort(scores[top])[::-1]]
+            return [dict(self.metadata(rows[i]), score=round(float(scores[i]), 4)) for i in top]
@@ -0,0 +1,321 @@
+"""
+Preprocess an image dataset once into sharded, memory-mapped tensor files
+and re-evaluate models from them without decoding images again.
+
+Datasets are class folders (<src>/<label>/<image>). A store is built per
+model preprocessing spec (the same decode/resize steps as the
+preprocess_*_image functions in app.py) and lives in
+<out>/<model>-<spec hash>/:
+
+    manifest.json      spec, dtype, tensor shape, shard list with sha256,
+                       and a content hash of every source image
+    index.jsonl        one line per row: source path, label, source sha256
+    shard-00000.npy    (rows, H, W, C) uint8 (or normalized float16) .npy
+
+Rebuilding with unchanged sources and spec is a no-op. A changed dataset is
+built into a temporary directory that then replaces the old store, so
+readers that still have the old shards memory-mapped are never affected.
+Readers memory-map the shards and hand out zero-copy batch views.
+
+    python tensor_store.py build pneumonia data/chest_xray/test --out stores
+    python tensor_store.py evaluate stores/pneumonia-<hash> ../ml_models/pneumonia_model_final.h5
+    python tensor_store.py verify stores/pneumonia-<hash>
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+SPEC_VERSION = 1
+DEFAULT_SHARD_SIZE = 1024
+DEFAULT_BATCH_SIZE = 64
+
+# Decode steps before normalization, mirroring the preprocess_*_image
+# functions in app.py. Bump SPEC_VERSION when changing how a decode works.
+PREPROCESS_SPECS = {
+    'brain_tumor': {'decode': 'rgb_to_gray', 'size': [224, 224]},
+    'breast_cancer': {'decode': 'rgb', 'size': [224, 224]},
+    'pneumonia': {'decode': 'gray', 'size': [224, 224]},
+    'bone_fracture': {'decode': 'gray', 'size': [224, 224]},
+    'anemia': {'decode': 'rgb', 'size': [224, 224]},
+    'skin_cancer': {'decode': 'rgb', 'size': [224, 224]},
+}
+
+
+def decode_image(path, spec):
+    """Decode one image to an (H, W, C) uint8 array following `spec`."""
+    size = tuple(spec['size'])
+    if spec['decode'] == 'gray':
+        return np.array(Image.open(path).convert('L').resize(size))[..., np.newaxis]
+    img = np.array(Image.open(path).convert('RGB').resize(size))
+    if spec['decode'] == 'rgb_to_gray':
+        import cv2
+        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)[..., np.newaxis]
+    return img
+
+
+def spec_hash(spec, dtype):
+    key = json.dumps({'spec': spec, 'dtype': dtype, 'version': SPEC_VERSION}, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_dataset(src):
+    """(relative path, label) for every image under class folders of `src`, sorted."""
+    items = []
+    for root, _, files in os.walk(src):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, src)
+                label = os.path.dirname(rel).split(os.sep)[0] or None
+                items.append((rel, label))
+    return sorted(items)
+
+
+def _preprocess_worker(args):
+    src, rel, spec, dtype = args
+    path = os.path.join(src, rel)
+    tensor = decode_image(path, spec)
+    if dtype == 'float16':
+        tensor = (tensor.astype(np.float32) / 255.0).astype(np.float16)
+    return tensor
+
+
+def build_store(model_key, src, out, dtype='uint8', shard_size=DEFAULT_SHARD_SIZE, workers=None):
+    """Preprocess `src` once for `model_key`; returns the store directory."""
+    spec = PREPROCESS_SPECS[model_key]
+    digest = spec_hash(spec, dtype)
+    store_dir = os.path.join(out, f'{model_key}-{digest[:12]}')
+    items = list_dataset(src)
+    if not items:
+        raise ValueError(f"No images found under {src}")
+
+    # Content hash of the dataset: rebuild only if an image or the spec changed
+    with Pool(workers) as pool:
+        source_hashes = pool.map(file_sha256, [os.path.join(src, rel) for rel, _ in items], chunksize=64)
+    dataset_hash = hashlib.sha256(
+        ''.join(f'{rel}\0{sha}\n' for (rel, _), sha in zip(items, source_hashes)).encode('utf-8')
+    ).hexdigest()
+    manifest_path = os.path.join(store_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f).get('dataset_sha256') == dataset_hash:
+                print(f"{store_dir} is up to date ({len(items)} images)")
+                return store_dir
+
+    # Build next to the store and swap it in at the end; the old store's
+    # shards are never rewritten while a reader may have them mapped
+    os.makedirs(out, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix=f'.{os.path.basename(store_dir)}-build-', dir=out)
+    # mkdtemp makes the directory private; give it the usual permissions
+    os.chmod(build_dir, 0o755)
+    try:
+        tensor_shape = decode_image(os.path.join(src, items[0][0]), spec).shape
+        shards = []
+        started = time.perf_counter()
+        with Pool(workers) as pool, open(os.path.join(build_dir, 'index.jsonl'), 'w') as index:
+            tensors = pool.imap(_preprocess_worker, [(src, rel, spec, dtype) for rel, _ in items], chunksize=16)
+            for shard_start in range(0, len(items), shard_size):
+                shard_items = items[shard_start:shard_start + shard_size]
+                name = f'shard-{len(shards):05d}.npy'
+                shard = np.lib.format.open_memmap(
+                    os.path.join(build_dir, name), mode='w+', dtype=dtype,
+                    shape=(len(shard_items),) + tensor_shape,
+                )
+                for row, (rel, label) in enumerate(shard_items):
+                    shard[row] = next(tensors)
+                    sha = source_hashes[shard_start + row]
+                    index.write(json.dumps({'path': rel, 'label': label, 'sha256': sha}) + '\n')
+                shard.flush()
+                del shard
+                shards.append({'file': name, 'rows': len(shard_items), 'sha256': file_sha256(os.path.join(build_dir, name))})
+                print(f"  {name}: {len(shard_items)} images")
+
+        manifest = {
+            'model': model_key,
+            'spec': spec,
+            'spec_sha256': digest,
+            'dtype': dtype,
+            'tensor_shape': list(tensor_shape),
+            'rows': len(items),
+            'shards': shards,
+            'source': os.path.abspath(src),
+            'dataset_sha256': dataset_hash,
+            'created': time.time(),
+        }
+        with open(os.path.join(build_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    # Move the old store aside, move the new one in, then delete the old one.
+    # Open memmaps of old shards stay valid after their files are unlinked.
+    old_dir = None
+    if os.path.exists(store_dir):
+        old_dir = tempfile.mkdtemp(prefix=f'.{os.path.basename(store_dir)}-old-', dir=out)
+        os.replace(store_dir, os.path.join(old_dir, 'store'))
+    os.replace(build_dir, store_dir)
+    if old_dir:
+        shutil.rmtree(old_dir)
+    print(f"Built {store_dir}: {len(items)} images in {time.perf_counter() - started:.1f}s")
+    return store_dir
+
+
+class TensorStore:
+    """Read-only view of a built store; shards are memory-mapped, never copied."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.shards = [
+            np.load(os.path.join(store_dir, shard['file']), mmap_mode='r')
+            for shard in self.manifest['shards']
+        ]
+        # Opened now so a rebuild swapping in a new store cannot change the rows under us
+        self._index_file = open(os.path.join(store_dir, 'index.jsonl'))
+        self._index = None
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._index_file as f:
+                self._index = [json.loads(line) for line in f]
+        return self._index
+
+    def labels(self):
+        return [entry['label'] for entry in self.index]
+
+    def batches(self, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Yield (first row, batch) in order. Batches are zero-copy views into the
+        memory-mapped shards and never span two shards.
+        """
+        row = 0
+        for shard in self.shards:
+            for start in range(0, len(shard), batch_size):
+                batch = shard[start:start + batch_size]
+                yield row, batch
+                row += len(batch)
+
+    def as_model_input(self, batch, channels=None):
+        """Normalize a stored batch the way app.py does (float32 in [0, 1])."""
+        if self.manifest['dtype'] == 'uint8':
+            x = batch.astype(np.float32)
+            x *= 1.0 / 255.0
+        else:
+            x = batch.astype(np.float32)
+        if channels and channels != x.shape[-1]:
+            x = np.repeat(x, channels, axis=-1)
+        return x
+
+    def model_batches(self, batch_size=DEFAULT_BATCH_SIZE, channels=None, prefetch=2):
+        """
+        Normalized batches ready for model.predict. A background thread
+        prepares the next batches while the model runs on the current one.
+        """
+        ready = queue.Queue(maxsize=prefetch)
+
+        def produce():
+            for row, batch in self.batches(batch_size):
+                ready.put((row, self.as_model_input(batch, channels)))
+            ready.put(None)
+
+        threading.Thread(target=produce, daemon=True).start()
+        while True:
+            item = ready.get()
+            if item is None:
+                return
+            yield item
+
+    def verify(self):
+        """Re-hash every shard; returns the names of shards that do not match the manifest."""
+        return [
+            shard['file'] for shard in self.manifest['shards']
+            if file_sha256(os.path.join(self.store_dir, shard['file'])) != shard['sha256']
+        ]
+
+
+def evaluate_store(store_dir, model_path, batch_size=DEFAULT_BATCH_SIZE):
+    """Run a model over a store; saves predictions.npy and prints label vs predicted class counts."""
+    from tensorflow.keras.models import load_model
+
+    store = TensorStore(store_dir)
+    model = load_model(model_path)
+    predictions = None
+    started = time.perf_counter()
+    for row, x in store.model_batches(batch_size, channels=model.input_shape[-1]):
+        batch_predictions = model.predict(x, verbose=0)
+        if predictions is None:
+            predictions = np.empty((len(store),) + batch_predictions.shape[1:], dtype=np.float32)
+        predictions[row:row + len(x)] = batch_predictions
+    elapsed = time.perf_counter() - started
+
+    out_path = os.path.join(store_dir, f'predictions-{os.path.basename(model_path)}.npy')
+    np.save(out_path, predictions)
+    if predictions.shape[-1] == 1:
+        predicted = (predictions[:, 0] >= 0.5).astype(int)
+    else:
+        predicted = np.argmax(predictions, axis=1)
+
+    print(f"{len(store)} images in {elapsed:.1f}s ({len(store) / elapsed:.1f} images/s), predictions in {out_path}")
+    counts = {}
+    for label, index in zip(store.labels(), predicted):
+        counts.setdefault(label, {}).setdefault(int(index), 0)
+        counts[label][int(index)] += 1
+    for label in sorted(counts, key=str):
+        print(f"  {label}: " + ', '.join(f"class {i}: {n}" for i, n in sorted(counts[label].items())))
+    return predictions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="Preprocess a dataset into a store")
+    build.add_argument('model', choices=sorted(PREPROCESS_SPECS))
+    build.add_argument('src', help="Dataset root with one folder per class")
+    build.add_argument('--out', default='tensor_stores')
+    build.add_argument('--dtype', choices=['uint8', 'float16'], default='uint8',
+                       help="uint8 keeps raw pixels (normalized on read); float16 stores normalized values")
+    build.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    build.add_argument('--workers', type=int, default=None)
+
+    evaluate = commands.add_parser('evaluate', help="Run a model over a store")
+    evaluate.add_argument('store')
+    evaluate.add_argument('model_path')
+    evaluate.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    verify = commands.add_parser('verify', help="Check shard hashes against the manifest")
+    verify.add_argument('store')
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_store(args.model, args.src, args.out, args.dtype, args.shard_size, args.workers)
+    elif args.command == 'evaluate':
+        evaluate_store(args.store, args.model_path, args.batch_size)
+    else:
+        bad = TensorStore(args.store).verify()
+        print("All shards match the manifest" if not bad else f"Corrupt shards: {', '.join(bad)}")
@@ -0,0 +1,28 @@
+import time
+
+import numpy as np
+
+import similarity
+from similarity import VectorIndex
+
+
+def wait_for_training(index, timeout=30):
+    deadline = time.monotonic() + timeout
+    while index._training and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_trains_when_count_is_not_a_power_of_two(tmp_path, monkeypatch):
+    # Capacity grows by doubling, so training at 300 rows reads from a
+    # 1024-row memmap: the snapshot must stop at `count`
+    monkeypatch.setattr(similarity, 'TRAIN_MIN_VECTORS', 300)
+    rng = np.random.default_rng(0)
+    index = VectorIndex(str(tmp_path / 'index'))
+    for i in range(300):
+        index.add(rng.standard_normal(32), {'case_id': i})
+    wait_for_training(index)
+
+    assert index.state['n_lists'] > 0
+    assert index.state['trained_at'] == 300
+    matches = index.search(rng.standard_normal(32), k=5)
+    assert len(matches) == 5
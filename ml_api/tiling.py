@@ -0,0 +1,189 @@
+"""
+Tiled sliding-window inference for high-resolution histopathology and
+dermatoscopy images.
+
+Instead of squashing the whole image to 224x224, the image is covered with
+overlapping model-sized tiles. Background tiles are skipped with a cheap
+tissue mask, the rest go through the model in large batches, and the tile
+scores are combined into an image-level score and a coarse heatmap.
+
+Runtime stays bounded: images whose tile grid would exceed MAX_TILES are
+downscaled before tiling, and very elongated images are squeezed along
+their long side. JPEG uploads are reduced while decoding (draft mode);
+other formats are decoded at native resolution first, so they are limited
+to MAX_DECODE_PIXELS.
+"""
+import math
+
+import numpy as np
+from PIL import Image
+
+TILE_SIZE = 224
+TILE_OVERLAP = 56
+TILE_STRIDE = TILE_SIZE - TILE_OVERLAP
+TILE_BATCH_SIZE = 64
+MAX_TILES = 256
+
+# Largest image decoded at full resolution (about 200 MB as RGB); larger
+# non-JPEG uploads are refused rather than risk running out of memory
+MAX_DECODE_PIXELS = 8192 * 8192
+
+# Tissue mask: pixels that are neither glass/white background nor black
+# vignette; a tile needs this share of tissue to be scored
+MASK_DOWNSAMPLE = 8
+TISSUE_MIN_LUMINANCE = 0.08
+TISSUE_MAX_LUMINANCE = 0.85
+TISSUE_MIN_FRACTION = 0.1
+
+# Image-level score is the mean of the top share of tile scores
+TOP_TILE_FRACTION = 0.1
+
+
+class ImageTooLarge(Exception):
+    status_code = 413
+
+
+def tiles_along(length):
+    """Number of tiles needed to cover `length` pixels."""
+    return max(1, math.ceil((length - TILE_OVERLAP) / TILE_STRIDE))
+
+
+def bounded_size(width, height):
+    """Largest size (never below one tile per side) whose grid fits in MAX_TILES."""
+    scale = 1.0
+    while tiles_along(int(height * scale)) * tiles_along(int(width * scale)) > MAX_TILES:
+        scale *= 0.9
+    # Images smaller than a tile are scaled up so the shorter side fits one
+    scale = max(scale, TILE_SIZE / min(width, height))
+    width, height = max(TILE_SIZE, round(width * scale)), max(TILE_SIZE, round(height * scale))
+    # The upscale can push an elongated image back over the cap: shrink the
+    # long side to the most tiles the short side leaves room for
+    if width >= height:
+        width = min(width, TILE_OVERLAP + (MAX_TILES // tiles_along(height)) * TILE_STRIDE)
+    else:
+        height = min(height, TILE_OVERLAP + (MAX_TILES // tiles_along(width)) * TILE_STRIDE)
+    return width, height
+
+
+def open_for_tiling(image_stream):
+    """
+    Open an upload without decoding it and set up draft decoding. Returns
+    (image, original size, target size); raises ImageTooLarge when the
+    decode would exceed MAX_DECODE_PIXELS.
+    """
+    try:
+        image = Image.open(image_stream)
+        size = image.size
+        target = bounded_size(*size)
+        # JPEG decodes straight to a smaller scale in draft mode; other
+        # formats keep their native size here
+        image.draft('RGB', target)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    if image.size[0] * image.size[1] > MAX_DECODE_PIXELS:
+        raise ImageTooLarge(
+            f"Image is {size[0]}x{size[1]}; tiled mode decodes at most {MAX_DECODE_PIXELS} pixels "
+            f"for this format (JPEG uploads are reduced while decoding)"
+        )
+    return image, size, target
+
+
+def check_tiling_size(image_stream):
+    """Raise ImageTooLarge from the header alone, then rewind; run before any decode."""
+    try:
+        open_for_tiling(image_stream)
+    finally:
+        image_stream.seek(0)
+
+
+def load_tiling_image(image_stream):
+    """
+    Decode an upload for tiling.
+    Returns an (H, W, 3) uint8 array and the (x, y) scale applied to fit
+    MAX_TILES. Raises ImageTooLarge when the image cannot be decoded within
+    MAX_DECODE_PIXELS.
+    """
+    image, (width, height), target = open_for_tiling(image_stream)
+    image = image.convert('RGB')
+    if image.size != target:
+        image = image.resize(target)
+    return np.asarray(image), (target[0] / float(width), target[1] / float(height))
+
+
+def tile_origins(length):
+    """Tile start offsets along one axis; the last tile is aligned to the edge."""
+    count = tiles_along(length)
+    return [min(i * TILE_STRIDE, length - TILE_SIZE) for i in range(count)]
+
+
+def tissue_fractions(image, row_origins, col_origins):
+    """Share of tissue pixels in every tile, from a strided low-resolution view."""
+    small = image[::MASK_DOWNSAMPLE, ::MASK_DOWNSAMPLE].astype(np.float32) / 255.0
+    luminance = small @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    tissue = (luminance > TISSUE_MIN_LUMINANCE) & (luminance < TISSUE_MAX_LUMINANCE)
+
+    # Summed-area table: tissue count of any rectangle in O(1)
+    integral = np.zeros((tissue.shape[0] + 1, tissue.shape[1] + 1), dtype=np.int32)
+    integral[1:, 1:] = tissue.cumsum(axis=0).cumsum(axis=1)
+    size = TILE_SIZE // MASK_DOWNSAMPLE
+    top = np.array(row_origins) // MASK_DOWNSAMPLE
+    left = np.array(col_origins) // MASK_DOWNSAMPLE
+    bottom = np.minimum(top + size, tissue.shape[0])
+    right = np.minimum(left + size, tissue.shape[1])
+    counts = (
+        integral[bottom[:, None], right[None, :]] - integral[top[:, None], right[None, :]]
+        - integral[bottom[:, None], left[None, :]] + integral[top[:, None], left[None, :]]
+    )
+    areas = (bottom - top)[:, None] * (right - left)[None, :]
+    return counts / np.maximum(areas, 1)
+
+
+def iter_tile_batches(image, origins, batch_size=TILE_BATCH_SIZE):
+    """
+    Yield normalized float32 tile batches for (y, x) origins.
+    The batch buffer is reused, so each batch must be consumed before the next.
+    """
+    buffer = np.empty((min(batch_size, len(origins)), TILE_SIZE, TILE_SIZE, 3), dtype=np.float32)
+    for start in range(0, len(origins), batch_size):
+        chunk = origins[start:start + batch_size]
+        for i, (y, x) in enumerate(chunk):
+            buffer[i] = image[y:y + TILE_SIZE, x:x + TILE_SIZE]
+        batch = buffer[:len(chunk)]
+        batch *= 1.0 / 255.0
+        yield batch
+
+
+def predict_tiles(image, predict_fn, scale=(1.0, 1.0)):
+    """
+    Score every tissue tile of `image` with `predict_fn(batch) -> predictions`.
+    Returns the image-level score, a coarse heatmap (None for skipped tiles)
+    and tile counts.
+    """
+    row_origins = tile_origins(image.shape[0])
+    col_origins = tile_origins(image.shape[1])
+    keep = tissue_fractions(image, row_origins, col_origins) >= TISSUE_MIN_FRACTION
+    if not keep.any():
+        # Mask found nothing; score everything rather than return no answer
+        keep[:] = True
+
+    cells = np.argwhere(keep)
+    origins = [(row_origins[r], col_origins[c]) for r, c in cells]
+    scores = np.empty(len(origins), dtype=np.float32)
+    done = 0
+    for batch in iter_tile_batches(image, origins):
+        predictions = np.asarray(predict_fn(batch)).reshape(len(batch), -1)
+        # Last output column is the positive class for sigmoid and 2-way softmax
+        scores[done:done + len(batch)] = predictions[:, -1]
+        done += len(batch)
+
+    top_k = max(1, math.ceil(len(scores) * TOP_TILE_FRACTION))
+    heatmap = np.full(keep.shape, np.nan, dtype=np.float32)
+    heatmap[cells[:, 0], cells[:, 1]] = scores
+    return {
+        'score': float(np.sort(scores)[-top_k:].mean()),
+        'max_tile_score': float(scores.max()),
+        'heatmap': [[None if np.isnan(v) else round(float(v), 3) for v in row] for row in heatmap],
+        'tiles_total': int(keep.size),
+        'tiles_scored': int(len(scores)),
+        'scale': [round(v, 4) for v in scale],
+    }
@@ -1,3 +1,6 @@
+import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from PIL import Image, ImageTk
@@ -64,10 +67,17 @@ tumor_names = {
     3: 'No Tumor'
 }
 
-def preprocess_image(image_path, img_size=(224, 224)):
+def load_image(image_path):
     img = cv2.imread(image_path)
     if img is None:
         raise ValueError(f"Image not found or could not be loaded: {image_path}")
+    return img
+
+def preprocess_image(image_path, img_size=(224, 224)):
+    return preprocess_decoded(load_image(image_path), img_size)
+
+def preprocess_decoded(img, img_size=(224, 224)):
+    """Model input from an image already decoded by cv2 (BGR)."""
     img = cv2.resize(img, img_size)
     img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     img = np.expand_dims(img, axis=-1)
@@ -75,14 +85,6 @@ def preprocess_image(image_path, img_size=(224, 224)):
     img = np.expand_dims(img, axis=0)
     return img
 
-def predict_tumor(image_path):
-    processed_image = preprocess_image(image_path)
-    predictions = model.predict(processed_image)
-    predicted_class_index = np.argmax(predictions, axis=1)[0]
-    predicted_class_name = tumor_names.get(predicted_class_index, "Unknown")
-    is_tumor_present = predicted_class_name != 'No Tumor'
-    return predicted_class_name, is_tumor_present
-
 def draw_bounding_box(image_path, is_tumor_present):
     img = cv2.imread(image_path)
     if is_tumor_present:
@@ -96,19 +98,176 @@ def draw_bounding_box(image_path, is_tumor_present):
             cv2.rectangle(img, (x, y), (x + w, y + h), (255, 0, 0), 2)
     return img
 
+# Folder-mode tuning: images per model.predict call, how many decoded images
+# the loader may run ahead of the model, and thumbnail grid geometry.
+BATCH_SIZE = 16
+PREFETCH_BATCHES = 4
+THUMB_SIZE = (96, 96)
+GRID_COLUMNS = 5
+POLL_INTERVAL_MS = 50
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def make_thumbnail(img, size=THUMB_SIZE):
+    """
+    Grid thumbnail from a cv2-decoded (BGR) image, so folder images are only
+    decoded once. Returns a PIL image; ImageTk conversion must happen on the Tk thread.
+    """
+    height, width = img.shape[:2]
+    scale = min(size[0] / width, size[1] / height, 1.0)
+    small = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    return Image.fromarray(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+
+def predict_tumor_batch(processed_images):
+    """Run one model.predict over a stack of preprocessed images."""
+    predictions = model.predict(np.concatenate(processed_images, axis=0), verbose=0)
+    results = []
+    for row in predictions:
+        predicted_class_index = int(np.argmax(row))
+        predicted_class_name = tumor_names.get(predicted_class_index, "Unknown")
+        results.append((predicted_class_name, predicted_class_name != 'No Tumor', float(np.max(row))))
+    return results
+
+class InferenceWorker:
+    """
+    Runs model inference off the Tk main thread.
+    Jobs go in through submit_*; results come back on result_queue and are
+    drained by the app with root.after, so Tk widgets are only touched there.
+    Single images have their own queue and run between folder batches, so
+    they never wait for a whole folder.
+    """
+    def __init__(self):
+        self.result_queue = queue.Queue()
+        self._jobs = queue.Queue()
+        self._images = queue.Queue()
+        # Bumped per folder; a folder job whose generation is no longer the
+        # current one has been replaced and stops, even if it is still queued
+        self.generation = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit_image(self, image_path):
+        self._images.put(image_path)
+        # Wakes the worker if it is idle; a running folder picks the image up itself
+        self._jobs.put(('image', None))
+
+    def submit_folder(self, image_paths):
+        # A new folder replaces whatever folder is still queued or being processed
+        self.generation += 1
+        self._jobs.put(('folder', (self.generation, image_paths)))
+
+    def _run(self):
+        while True:
+            kind, payload = self._jobs.get()
+            try:
+                if kind == 'image':
+                    self._drain_images()
+                else:
+                    self._predict_folder(*payload)
+            except Exception as e:
+                self.result_queue.put(('error', None, str(e)))
+
+    def _drain_images(self):
+        while True:
+            try:
+                image_path = self._images.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self._predict_image(image_path)
+            except Exception as e:
+                self.result_queue.put(('error', None, str(e)))
+
+    def _predict_image(self, image_path):
+        predicted_class_name, is_tumor_present, _ = predict_tumor_batch([preprocess_image(image_path)])[0]
+        processed_img = draw_bounding_box(image_path, is_tumor_present)
+        processed_img = cv2.cvtColor(processed_img, cv2.COLOR_BGR2RGB)
+        img_with_box = Image.fromarray(processed_img).resize((400, 400))
+        self.result_queue.put(('image', None, (predicted_class_name, is_tumor_present, img_with_box)))
+
+    def _prefetch(self, generation, image_paths, loaded):
+        # Decode and preprocess ahead of the model; the bounded queue keeps
+        # memory flat however large the folder is.
+        for image_path in image_paths:
+            if generation != self.generation:
+                break
+            try:
+                img = load_image(image_path)
+                item = (image_path, preprocess_decoded(img), make_thumbnail(img), None)
+            except Exception as e:
+                item = (image_path, None, None, str(e))
+            loaded.put(item)
+        loaded.put(None)
+
+    def _predict_folder(self, generation, image_paths):
+        if generation != self.generation:
+            # Replaced while still queued
+            return
+        loaded = queue.Queue(maxsize=BATCH_SIZE * PREFETCH_BATCHES)
+        threading.Thread(target=self._prefetch, args=(generation, image_paths, loaded), daemon=True).start()
+        self.result_queue.put(('folder_start', generation, len(image_paths)))
+        batch = []
+        done = False
+        while not done:
+            item = loaded.get()
+            if item is None:
+                done = True
+            elif item[1] is None:
+                image_path, _, _, error = item
+                self.result_queue.put(('tile', generation, (image_path, None, error, None)))
+            else:
+                batch.append(item)
+            # Flush when the batch is full or the loader has caught up, so
+            # the grid keeps filling even when decoding is the bottleneck.
+            if batch and (done or len(batch) >= BATCH_SIZE or loaded.empty()):
+                # Single-image requests go ahead of the next folder batch
+                self._drain_images()
+                if generation != self.generation:
+                    break
+                results = predict_tumor_batch([processed for _, processed, _, _ in batch])
+                for (image_path, _, thumb, _), result in zip(batch, results):
+                    self.result_queue.put(('tile', generation, (image_path, thumb, None, result)))
+                batch = []
+        if not done:
+            # Unblock the loader so it notices the newer generation and exits
+            while loaded.get() is not None:
+                pass
+        else:
+            self.result_queue.put(('folder_done', generation, None))
+
 class TumorClassifierApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Brain Tumor Classifier")
-        self.root.geometry("600x700")
+        self.root.geometry("700x900")
 
         tk.Label(root, text="Brain Tumor Classifier", font=("Arial", 20)).pack(pady=20)
-        tk.Button(root, text="Upload Image", command=self.upload_image).pack(pady=10)
+        buttons = tk.Frame(root)
+        buttons.pack(pady=10)
+        tk.Button(buttons, text="Upload Image", command=self.upload_image).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Open Folder", command=self.open_folder).pack(side=tk.LEFT, padx=5)
         self.canvas = tk.Canvas(root, width=400, height=400, bg="lightgray")
         self.canvas.pack(pady=10)
-        tk.Button(root, text="Predict Tumor", command=self.predict_image).pack(pady=10)
+        self.predict_button = tk.Button(root, text="Predict Tumor", command=self.predict_image)
+        self.predict_button.pack(pady=10)
         self.result_label = tk.Label(root, text="", font=("Arial", 14))
-        self.result_label.pack(pady=20)
+        self.result_label.pack(pady=10)
+
+        # Scrollable thumbnail grid for folder mode
+        grid_container = tk.Frame(root)
+        grid_container.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.grid_canvas = tk.Canvas(grid_container, highlightthickness=0)
+        scrollbar = tk.Scrollbar(grid_container, orient=tk.VERTICAL, command=self.grid_canvas.yview)
+        self.grid_canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.grid_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.grid_frame = tk.Frame(self.grid_canvas)
+        self.grid_canvas.create_window((0, 0), window=self.grid_frame, anchor=tk.NW)
+        self.grid_frame.bind("<Configure>", lambda e: self.grid_canvas.configure(scrollregion=self.grid_canvas.bbox("all")))
+
+        self.tiles = []
+        self.folder_total = 0
+        self.tumor_count = 0
+        self.worker = InferenceWorker()
+        self.root.after(POLL_INTERVAL_MS, self.poll_results)
 
     def upload_image(self):
         self.image_path = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg *.jpeg *.png")])
@@ -118,21 +277,84 @@ class TumorClassifierApp:
             self.img_tk = ImageTk.PhotoImage(img)
             self.canvas.create_image(0, 0, anchor=tk.NW, image=self.img_tk)
 
+    def open_folder(self):
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+        image_paths = sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not image_paths:
+            messagebox.showwarning("No Images", "The selected folder has no .jpg/.jpeg/.png images.")
+            return
+        for tile in self.tiles:
+            tile.destroy()
+        self.tiles = []
+        self.tumor_count = 0
+        self.worker.submit_folder(image_paths)
+
     def predict_image(self):
-        if hasattr(self, 'image_path'):
-            predicted_class_name, is_tumor_present = predict_tumor(self.image_path)
+        if hasattr(self, 'image_path') and self.image_path:
+            self.predict_button.config(state=tk.DISABLED)
+            self.result_label.config(text="Predicting...")
+            self.worker.submit_image(self.image_path)
+        else:
+            messagebox.showwarning("No Image", "Please upload an image first.")
+
+    def poll_results(self):
+        try:
+            while True:
+                kind, generation, payload = self.worker.result_queue.get_nowait()
+                if generation is None or generation == self.worker.generation:
+                    self.handle_result(kind, payload)
+        except queue.Empty:
+            pass
+        self.root.after(POLL_INTERVAL_MS, self.poll_results)
+
+    def handle_result(self, kind, payload):
+        if kind == 'image':
+            predicted_class_name, is_tumor_present, img_with_box = payload
             result_text = f"Tumor Detected: {predicted_class_name}" if is_tumor_present else "No Tumor Detected"
             self.result_label.config(text=result_text)
-
-            processed_img = draw_bounding_box(self.image_path, is_tumor_present)
-            processed_img = cv2.cvtColor(processed_img, cv2.COLOR_BGR2RGB)
-            img_with_box = Image.fromarray(processed_img)
-            img_with_box = img_with_box.resize((400, 400))
             self.img_tk_with_box = ImageTk.PhotoImage(img_with_box)
             self.canvas.create_image(0, 0, anchor=tk.NW, image=self.img_tk_with_box)
-
+            self.predict_button.config(state=tk.NORMAL)
+        elif kind == 'folder_start':
+            self.folder_total = payload
+            self.result_label.config(text=f"Processing 0/{payload} images...")
+        elif kind == 'tile':
+            self.add_tile(*payload)
+            self.result_label.config(
+                text=f"Processing {len(self.tiles)}/{self.folder_total} images... ({self.tumor_count} with tumor)"
+            )
+        elif kind == 'folder_done':
+            self.result_label.config(
+                text=f"Done: {len(self.tiles)} images, {self.tumor_count} with tumor detected"
+            )
+        elif kind == 'error':
+            self.predict_button.config(state=tk.NORMAL)
+            self.result_label.config(text="")
+            messagebox.showerror("Prediction Error", payload)
+
+    def add_tile(self, image_path, thumb, error, result):
+        tile = tk.Frame(self.grid_frame, bd=2, relief=tk.GROOVE)
+        row, column = divmod(len(self.tiles), GRID_COLUMNS)
+        tile.grid(row=row, column=column, padx=4, pady=4)
+        if thumb is not None:
+            tile.photo = ImageTk.PhotoImage(thumb)
+            tk.Label(tile, image=tile.photo).pack()
+        if result is not None:
+            predicted_class_name, is_tumor_present, confidence = result
+            if is_tumor_present:
+                self.tumor_count += 1
+            caption = f"{predicted_class_name} ({confidence * 100:.0f}%)"
+            color = "red" if is_tumor_present else "green"
         else:
-            messagebox.showwarning("No Image", "Please upload an image first.")
+            caption, color = "Unreadable", "gray"
+        tk.Label(tile, text=caption, fg=color, font=("Arial", 9)).pack()
+        tk.Label(tile, text=os.path.basename(image_path)[:16], font=("Arial", 8)).pack()
+        self.tiles.append(tile)
 
 if __name__ == "__main__":
     root = tk.Tk()